@@ -1,19 +1,24 @@
+import asyncio
+import multiprocessing
 import os
 import logging
-import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
+import aiosqlite
 import discord
 from discord.ext import commands
-from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 from dotenv import load_dotenv
 
+from watermark import overlay_logo
+
 # ------------------ CONFIG ------------------
 VOUCH_CHANNEL_ID = 1399270718247796744
 POINTS_PER_IMAGE = 1
-LOGO_PATH = "logo.png"      # falls back to text if not found
 DB_PATH = "points.db"
 COMMAND_PREFIX = "!"
+WATERMARK_WORKERS = 4       # attachments processed at once, across all messages
+WATERMARK_QUEUE_SIZE = 256  # pending attachments before on_message waits
 # --------------------------------------------
 
 # ---- logging ----
@@ -27,97 +32,151 @@ if not TOKEN:
     raise RuntimeError("TOKEN missing in .env")
 
 # ---- db ----
-def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""
+# One long-lived autocommit connection, opened in setup_hook as bot.sqlite_db.
+# aiosqlite runs statements on its own thread so disk IO never blocks the
+# event loop; WAL + synchronous=NORMAL keeps each write to a single append
+# instead of a full fsync of the database file.
+async def open_db() -> aiosqlite.Connection:
+    db = await aiosqlite.connect(DB_PATH, isolation_level=None)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("""
         CREATE TABLE IF NOT EXISTS points(
             user_id INTEGER PRIMARY KEY,
             points  INTEGER NOT NULL DEFAULT 0
         )
     """)
-    return conn
-
-def add_points(user_id: int, amount: int) -> int:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO points(user_id, points) VALUES(?, 0)", (user_id,))
-    cur.execute("UPDATE points SET points = points + ? WHERE user_id = ?", (amount, user_id))
-    conn.commit()
-    cur.execute("SELECT points FROM points WHERE user_id = ?", (user_id,))
-    total = cur.fetchone()[0]
-    conn.close()
-    return total
+    return db
 
-def get_points(user_id: int) -> int:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT points FROM points WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else 0
+# Totals only change through this process, so reads are served from memory;
+# every writer below updates (or, for a bulk reset, clears) the cache and bumps
+# _points_gen. A miss only fills the cache if no write landed during its SELECT,
+# so a slow read can't put back a total that was already replaced or reset.
+points_cache: dict[int, int] = {}
+_points_gen = 0
 
-# ---- helpers ----
-def is_image(attachment: discord.Attachment) -> bool:
-    if attachment.content_type and attachment.content_type.startswith("image/"):
-        return True
-    name = attachment.filename.lower()
-    return name.endswith((".png", ".jpg", ".jpeg", ".webp"))
+def _cache_points(user_id: int, total: int) -> None:
+    global _points_gen
+    _points_gen += 1
+    points_cache[user_id] = total
 
-def overlay_logo(img_bytes: bytes) -> BytesIO | None:
-    try:
-        base = Image.open(BytesIO(img_bytes)).convert("RGBA")
-    except UnidentifiedImageError:
-        log.warning("Attachment wasn't a decodable image.")
-        return None
-    except Exception as e:
-        log.exception("Opening image failed: %s", e)
+def clear_points_cache() -> None:
+    global _points_gen
+    _points_gen += 1
+    points_cache.clear()
+
+async def add_points(db: aiosqlite.Connection, user_id: int, amount: int) -> int:
+    async with db.execute(
+        "INSERT INTO points(user_id, points) VALUES(?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET points = points + excluded.points "
+        "RETURNING points",
+        (user_id, amount),
+    ) as cur:
+        (total,) = await cur.fetchone()
+    _cache_points(user_id, total)
+    return total
+
+async def remove_points(db: aiosqlite.Connection, user_id: int, amount: int) -> int | None:
+    """Clamp-subtract in one statement; None if the user has no row yet."""
+    async with db.execute(
+        "UPDATE points SET points = MAX(points - ?, 0) WHERE user_id = ? RETURNING points",
+        (amount, user_id),
+    ) as cur:
+        row = await cur.fetchone()
+    if not row:
         return None
+    _cache_points(user_id, row[0])
+    return row[0]
 
-    bw, bh = base.size
+async def get_points(db: aiosqlite.Connection, user_id: int) -> int:
+    cached = points_cache.get(user_id)
+    if cached is not None:
+        return cached
+    gen = _points_gen
+    async with db.execute("SELECT points FROM points WHERE user_id = ?", (user_id,)) as cur:
+        row = await cur.fetchone()
+    total = row[0] if row else 0
+    if gen == _points_gen:
+        points_cache[user_id] = total
+    return total
 
-    try:
-        if os.path.exists(LOGO_PATH):
-            logo = Image.open(LOGO_PATH).convert("RGBA")
-            target_w = int(bw * 0.35)
-            ratio = target_w / logo.width
-            logo = logo.resize((target_w, int(logo.height * ratio)), Image.LANCZOS)
-            alpha = logo.split()[3].point(lambda p: int(p * 0.35))
-            logo.putalpha(alpha)
-            x = (bw - logo.width) // 2
-            y = (bh - logo.height) // 2
-            base.paste(logo, (x, y), logo)
-        else:
-            txt_layer = Image.new("RGBA", base.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(txt_layer)
-            try:
-                font = ImageFont.truetype("arial.ttf", int(bh * 0.09))
-            except Exception:
-                font = ImageFont.load_default()
-            text = "FuelCart"
-            tw, th = draw.textsize(text, font=font)
-            x = (bw - tw) // 2
-            y = (bh - th) // 2
-            draw.text((x, y), text, font=font, fill=(255, 255, 255, 150))
-            base = Image.alpha_composite(base, txt_layer)
-
-        out = BytesIO()
-        base.convert("RGB").save(out, format="PNG")
-        out.seek(0)
-        return out
+# ---- helpers ----
+_IMG_EXTS = (".png", ".jpg", ".jpeg", ".webp")
 
-    except Exception as e:
-        log.exception("Watermarking crashed: %s", e)
-        return None
+def is_image(attachment: discord.Attachment) -> bool:
+    if attachment.content_type and attachment.content_type.startswith("image/"):
+        return True
+    return attachment.filename.lower().endswith(_IMG_EXTS)
 
 # ---- bot ----
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents)
 
+@bot.event
+async def setup_hook():
+    bot.sqlite_db = await open_db()
+    # spawn, not fork: the parent already runs an event loop and aiosqlite's thread
+    # At most WATERMARK_WORKERS jobs are ever in flight, so more processes would idle
+    bot.watermark_pool = ProcessPoolExecutor(
+        max_workers=min(WATERMARK_WORKERS, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    bot.watermark_workers = [asyncio.create_task(watermark_worker()) for _ in range(WATERMARK_WORKERS)]
+
 @bot.event
 async def on_ready():
     log.info("Logged in as %s (%s)", bot.user, bot.user.id)
 
+async def delete_quietly(message: discord.Message) -> None:
+    try:
+        await message.delete()
+    except discord.NotFound:
+        log.warning("Tried to delete a message that was already gone.")
+
+async def process_attachment(message: discord.Message, att: discord.Attachment) -> bool:
+    try:
+        # Download straight into a buffer PIL can read, no intermediate bytes copy
+        buf = BytesIO()
+        await att.save(buf)
+        # PIL work runs in a separate process: off the event loop and off the GIL
+        loop = asyncio.get_running_loop()
+        watermarked = await loop.run_in_executor(bot.watermark_pool, overlay_logo, buf)
+
+        if watermarked:
+            total = await add_points(bot.sqlite_db, message.author.id, POINTS_PER_IMAGE)
+            # One send carries both the image and the congrats; the delete runs alongside
+            await asyncio.gather(
+                message.channel.send(
+                    f"🎉 {message.author.mention} earned **{POINTS_PER_IMAGE}** point! Total: **{total}**",
+                    file=discord.File(BytesIO(watermarked), filename="fuelcart_watermarked.jpg"),
+                ),
+                delete_quietly(message),
+            )
+            return True
+        log.warning("Watermark returned None for %s", att.filename)
+
+    except Exception as e:
+        log.exception("Failed to process attachment %s: %s", att.filename, e)
+    return False
+
+# Watermarking goes through a bounded queue drained by a fixed pool of workers:
+# concurrency is capped at WATERMARK_WORKERS and a flood of uploads applies
+# back-pressure on on_message instead of piling up decode work.
+_WORK_Q: asyncio.Queue = asyncio.Queue(maxsize=WATERMARK_QUEUE_SIZE)
+
+async def watermark_worker():
+    while True:
+        message, att, fut = await _WORK_Q.get()
+        try:
+            # process_attachment logs and swallows its own failures
+            result = await process_attachment(message, att)
+            if not fut.done():  # on_message may have been cancelled meanwhile
+                fut.set_result(result)
+        finally:
+            _WORK_Q.task_done()
+
 @bot.event
 async def on_message(message: discord.Message):
     if message.author.bot:
@@ -127,35 +186,36 @@ async def on_message(message: discord.Message):
         log.info("Got message %s with %d attachments from %s",
                  message.id, len(message.attachments), message.author)
 
-        processed = False
-
+        images = []
         for att in message.attachments:
             if not is_image(att):
                 log.info("Skipped non-image attachment: %s (%s)", att.filename, att.content_type)
                 continue
+            images.append(att)
 
+        # Ack before queueing: a worker can finish (and delete the message) before
+        # put() returns when the queue is backed up
+        if images:
             try:
-                img_bytes = await att.read()
-                watermarked = overlay_logo(img_bytes)
-
-                if watermarked:
-                    await message.channel.send(file=discord.File(watermarked, filename="fuelcart_watermarked.png"))
-                    try:
-                        await message.delete()
-                    except discord.NotFound:
-                        log.warning("Tried to delete a message that was already gone.")
-                    total = add_points(message.author.id, POINTS_PER_IMAGE)
-                    await message.channel.send(
-                        f"🎉 {message.author.mention} earned **{POINTS_PER_IMAGE}** point! Total: **{total}**"
-                    )
-                    processed = True
-                else:
-                    log.warning("Watermark returned None for %s", att.filename)
-
-            except Exception as e:
-                log.exception("Failed to process attachment %s: %s", att.filename, e)
-
-        if not processed:
+                await message.add_reaction("⏳")
+            except discord.HTTPException:
+                pass
+
+        loop = asyncio.get_running_loop()
+        pending = []
+        for att in images:
+            fut = loop.create_future()
+            await _WORK_Q.put((message, att, fut))
+            pending.append(fut)
+
+        results = await asyncio.gather(*pending)
+
+        if not any(r is True for r in results):
+            if images:
+                try:
+                    await message.remove_reaction("⏳", bot.user)  # nothing is coming
+                except discord.HTTPException:
+                    pass
             await message.channel.send("❌ Couldn't watermark any attachment in that message.")
 
     await bot.process_commands(message)
@@ -164,38 +224,44 @@ async def on_message(message: discord.Message):
 @bot.command(name="points")
 async def points_cmd(ctx: commands.Context, member: discord.Member | None = None):
     member = member or ctx.author
-    total = get_points(member.id)
+    total = await get_points(bot.sqlite_db, member.id)
     await ctx.send(f"🏆 **{member.display_name}** has **{total}** point(s).")
 
 @bot.command(name="addpoints")
 @commands.has_permissions(manage_guild=True)
 async def addpoints_cmd(ctx: commands.Context, member: discord.Member, amount: int):
-    total = add_points(member.id, amount)
+    total = await add_points(bot.sqlite_db, member.id, amount)
     await ctx.send(f"✅ Added **{amount}** to {member.mention}. Total: **{total}**")
 
 @bot.command(name="resetpoints")
 @commands.has_permissions(administrator=True)
 async def resetpoints_cmd(ctx: commands.Context):
-    conn = db()
-    conn.execute("UPDATE points SET points = 0")
-    conn.commit()
-    conn.close()
+    # A missing row already reads as 0, so dropping the rows is a reset
+    await bot.sqlite_db.execute("DELETE FROM points")
+    clear_points_cache()
     await ctx.send("🔄 All points have been reset.")
 
 @bot.command(name="removepoints")
 @commands.has_permissions(administrator=True)
 async def removepoints_cmd(ctx: commands.Context, member: discord.Member, amount: int):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT points FROM points WHERE user_id = ?", (member.id,))
-    row = cur.fetchone()
-    if row:
-        new_total = max(row[0] - amount, 0)
-        cur.execute("UPDATE points SET points = ? WHERE user_id = ?", (new_total, member.id))
-        conn.commit()
+    new_total = await remove_points(bot.sqlite_db, member.id, amount)
+    if new_total is not None:
         await ctx.send(f"❌ Removed **{amount}** points from {member.mention}. New total: **{new_total}**")
     else:
         await ctx.send(f"⚠️ {member.mention} has no points.")
-    conn.close()
 
-bot.run(TOKEN)
\ No newline at end of file
+async def main():
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            # aiosqlite's worker thread keeps the process alive until closed
+            if getattr(bot, "sqlite_db", None):
+                await bot.sqlite_db.close()
+            if getattr(bot, "watermark_pool", None):
+                bot.watermark_pool.shutdown(cancel_futures=True)
+
+# Guarded: spawn still runs this script (as __mp_main__) in every pool worker,
+# and those must not start the bot
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+# watermark.py — the CPU-bound watermark step of the FuelCart bot.
+#
+# Kept apart from bot.py so what the process pool pickles and runs depends only
+# on PIL and this module's own state, not on the Discord/SQLite side.
+
+import functools
+import logging
+import os
+from io import BytesIO
+from typing import Callable
+
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+
+LOGO_PATH = "logo.png"      # falls back to text if not found
+
+log = logging.getLogger("fuelcart")
+
+# The logo and font never change at runtime: decode/load them once, and memoize
+# the per-size variants (resized logo with its 35% alpha baked in, font size).
+_LOGO_RGBA = Image.open(LOGO_PATH).convert("RGBA") if os.path.exists(LOGO_PATH) else None
+try:
+    _FONT_TEMPLATE = ImageFont.truetype("arial.ttf", 10)
+except Exception:
+    _FONT_TEMPLATE = None
+
+# 256-entry lookup table for the 35% watermark opacity, built once; point()
+# applies it in C without re-evaluating a Python callable on every call.
+_ALPHA_LUT = [int(p * 0.35) for p in range(256)]
+
+@functools.lru_cache(maxsize=32)
+def _logo_for_width(target_w: int) -> Image.Image:
+    ratio = target_w / _LOGO_RGBA.width
+    # BILINEAR is plenty for a flat graphic shown at 35% opacity
+    logo = _LOGO_RGBA.resize((target_w, int(_LOGO_RGBA.height * ratio)), Image.BILINEAR)
+    alpha = logo.split()[3].point(_ALPHA_LUT)
+    logo.putalpha(alpha)
+    return logo
+
+@functools.lru_cache(maxsize=32)
+def _font_for_size(size: int) -> ImageFont.ImageFont:
+    try:
+        return _FONT_TEMPLATE.font_variant(size=size)
+    except Exception:
+        return ImageFont.load_default()
+
+WATERMARK_TEXT = "FuelCart"
+
+@functools.lru_cache(maxsize=32)
+def _text_bbox(size: int) -> tuple[int, int, int, int]:
+    # ImageDraw.textsize is gone in Pillow 10; the bbox is fixed per font size
+    return _font_for_size(size).getbbox(WATERMARK_TEXT)
+
+def _make_logo_overlay() -> Callable[[Image.Image], None]:
+    def apply(base: Image.Image) -> None:
+        bw, bh = base.size
+        logo = _logo_for_width(int(bw * 0.35))
+        base.paste(logo, ((bw - logo.width) // 2, (bh - logo.height) // 2), logo)
+    return apply
+
+def _make_text_overlay() -> Callable[[Image.Image], None]:
+    fill = (255, 255, 255, 150)
+
+    def apply(base: Image.Image) -> None:
+        bw, bh = base.size
+        size = int(bh * 0.09)
+        left, top, right, bottom = _text_bbox(size)
+        tw, th = right - left, bottom - top
+        # Render into a layer just big enough for the text and blend only
+        # that patch, rather than allocating and compositing a full-size
+        # transparent layer over the whole photo
+        txt_layer = Image.new("RGBA", (tw, th), (255, 255, 255, 0))
+        ImageDraw.Draw(txt_layer).text((-left, -top), WATERMARK_TEXT, font=_font_for_size(size), fill=fill)
+        base.paste(txt_layer, ((bw - tw) // 2, (bh - th) // 2), txt_layer)
+    return apply
+
+# Whether logo.png exists is settled at startup, so pick the watermark once
+# instead of branching on every image.
+_OVERLAY = _make_logo_overlay() if _LOGO_RGBA is not None else _make_text_overlay()
+
+def overlay_logo(img_fp: BytesIO) -> bytes | None:
+    # Runs in the watermark process pool: arguments and the return value cross
+    # a pickle boundary, hence plain bytes out rather than a BytesIO.
+    try:
+        # Work in RGB end to end: paste() blends the RGBA logo/text through
+        # their own alpha, so the photo never needs a full-size RGBA copy
+        base = Image.open(img_fp)
+        if base.mode != "RGB":
+            base = base.convert("RGB")
+    except UnidentifiedImageError:
+        log.warning("Attachment wasn't a decodable image.")
+        return None
+    except Exception as e:
+        log.exception("Opening image failed: %s", e)
+        return None
+
+    try:
+        _OVERLAY(base)
+        out = BytesIO()
+        # Flat RGB photo out: JPEG encodes far faster and smaller than PNG
+        base.save(out, format="JPEG", quality=85)
+        return out.getvalue()
+
+    except Exception as e:
+        log.exception("Watermarking crashed: %s", e)
+        return None
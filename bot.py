@@ -1,12 +1,16 @@
-# bot.py — Fuel Cart Vouch Bot (PostgreSQL with auto-migration)
+# bot.py — Fuel Cart Vouch Bot (PostgreSQL or SQLite points store, see store.py)
 
+import asyncio
+import functools
+import io
 import os
 from typing import Optional
 
 import discord
 from discord.ext import commands
 from PIL import Image
-import psycopg2
+
+from store import PgStore, PointsStore, SqliteStore
 
 # ========== CONFIG ==========
 SERVER_NAME = "Fuel Cart"
@@ -24,170 +28,20 @@ LOGO_PATH = "logo.png"
 # ========== ENV VARS ==========
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+POINTS_DB_PATH = os.getenv("POINTS_DB_PATH", "points.db")  # used when DATABASE_URL is unset
 PER_GUILD = (os.getenv("PER_GUILD", "true").lower() in ("1", "true", "yes"))
 
 if not BOT_TOKEN:
     raise RuntimeError("Missing BOT_TOKEN env var")
-if not DATABASE_URL:
-    raise RuntimeError("Missing DATABASE_URL env var")
-
-# ========== DB SETUP (auto-migrate) ==========
-pg_conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-pg_conn.autocommit = True
-
-def init_db():
-    """
-    Ensure the 'points' table exists. If an old global schema exists, migrate it
-    to (guild_id, user_id) PK when PER_GUILD=True. Safe to run repeatedly.
-    """
-    with pg_conn.cursor() as cur:
-        # Create table if missing (start with per-guild or global shape)
-        if PER_GUILD:
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS points (
-                guild_id   BIGINT NOT NULL,
-                user_id    BIGINT NOT NULL,
-                points     INTEGER NOT NULL DEFAULT 0,
-                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                PRIMARY KEY (guild_id, user_id)
-            );
-            """)
-            # If an old global table exists, it may lack columns/PK
-            # 1) ensure columns exist
-            cur.execute("ALTER TABLE points ADD COLUMN IF NOT EXISTS guild_id BIGINT;")
-            cur.execute("ALTER TABLE points ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();")
-            # 2) if guild_id is NULL (from old rows), backfill with this bot's guild
-            cur.execute("UPDATE points SET guild_id=%s WHERE guild_id IS NULL;", (GUILD_ID,))
-            # 3) ensure PK is (guild_id, user_id)
-            # drop any existing PK and re-add
-            cur.execute("""
-            DO $$
-            DECLARE pkname text;
-            BEGIN
-              SELECT conname INTO pkname
-              FROM   pg_constraint c
-              JOIN   pg_class t ON t.oid = c.conrelid
-              WHERE  t.relname = 'points' AND c.contype = 'p'
-              LIMIT 1;
-              IF pkname IS NOT NULL THEN
-                EXECUTE format('ALTER TABLE points DROP CONSTRAINT %I', pkname);
-              END IF;
-            END$$;
-            """)
-            cur.execute("ALTER TABLE points ADD PRIMARY KEY (guild_id, user_id);")
-        else:
-            # Global points
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS points (
-                user_id    BIGINT PRIMARY KEY,
-                points     INTEGER NOT NULL DEFAULT 0,
-                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-            );
-            """)
-            # If table was per-guild, collapse to global by summing points
-            # (only if there's a guild_id column)
-            cur.execute("""
-            SELECT 1 FROM information_schema.columns
-            WHERE table_name='points' AND column_name='guild_id';
-            """)
-            if cur.fetchone():
-                # Build a temp table with summed totals
-                cur.execute("""
-                CREATE TEMP TABLE _tmp_points AS
-                  SELECT user_id, SUM(points)::int AS points
-                  FROM points
-                  GROUP BY user_id;
-                """)
-                # Replace real table with global shape
-                cur.execute("DROP TABLE IF EXISTS points;")
-                cur.execute("""
-                CREATE TABLE points (
-                    user_id    BIGINT PRIMARY KEY,
-                    points     INTEGER NOT NULL DEFAULT 0,
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """)
-                cur.execute("""
-                INSERT INTO points (user_id, points) SELECT user_id, points FROM _tmp_points;
-                """)
-
-def get_points(user_id: int, guild_id: Optional[int] = None) -> int:
-    with pg_conn.cursor() as cur:
-        if PER_GUILD:
-            if guild_id is None: raise ValueError("guild_id required (PER_GUILD=True)")
-            cur.execute("SELECT points FROM points WHERE guild_id=%s AND user_id=%s;", (guild_id, user_id))
-        else:
-            cur.execute("SELECT points FROM points WHERE user_id=%s;", (user_id,))
-        row = cur.fetchone()
-        return int(row[0]) if row else 0
-
-def add_points(user_id: int, amount: int, guild_id: Optional[int] = None) -> int:
-    with pg_conn.cursor() as cur:
-        if PER_GUILD:
-            if guild_id is None: raise ValueError("guild_id required (PER_GUILD=True)")
-            cur.execute("""
-                INSERT INTO points (guild_id, user_id, points)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (guild_id, user_id)
-                DO UPDATE SET points = points.points + EXCLUDED.points,
-                              updated_at = NOW()
-                RETURNING points;
-            """, (guild_id, user_id, amount))
-        else:
-            cur.execute("""
-                INSERT INTO points (user_id, points)
-                VALUES (%s, %s)
-                ON CONFLICT (user_id)
-                DO UPDATE SET points = points.points + EXCLUDED.points,
-                              updated_at = NOW()
-                RETURNING points;
-            """, (user_id, amount))
-        return int(cur.fetchone()[0])
-
-def remove_points(user_id: int, amount: int, guild_id: Optional[int] = None) -> int:
-    current = get_points(user_id, guild_id if PER_GUILD else None)
-    new_total = max(0, current - amount)
-    with pg_conn.cursor() as cur:
-        if PER_GUILD:
-            if guild_id is None: raise ValueError("guild_id required (PER_GUILD=True)")
-            cur.execute("""
-                INSERT INTO points (guild_id, user_id, points)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (guild_id, user_id)
-                DO UPDATE SET points = EXCLUDED.points,
-                              updated_at = NOW()
-                RETURNING points;
-            """, (guild_id, user_id, new_total))
-        else:
-            cur.execute("""
-                INSERT INTO points (user_id, points)
-                VALUES (%s, %s)
-                ON CONFLICT (user_id)
-                DO UPDATE SET points = EXCLUDED.points,
-                              updated_at = NOW()
-                RETURNING points;
-            """, (user_id, new_total))
-        return int(cur.fetchone()[0])
-
-def reset_points(user_id: int, guild_id: Optional[int] = None) -> None:
-    with pg_conn.cursor() as cur:
-        if PER_GUILD:
-            if guild_id is None: raise ValueError("guild_id required (PER_GUILD=True)")
-            cur.execute("""
-                INSERT INTO points (guild_id, user_id, points)
-                VALUES (%s, %s, 0)
-                ON CONFLICT (guild_id, user_id)
-                DO UPDATE SET points = 0,
-                              updated_at = NOW();
-            """, (guild_id, user_id))
-        else:
-            cur.execute("""
-                INSERT INTO points (user_id, points)
-                VALUES (%s, 0)
-                ON CONFLICT (user_id)
-                DO UPDATE SET points = 0,
-                              updated_at = NOW();
-            """, (user_id,))
+
+# ========== STORAGE ==========
+# Postgres when DATABASE_URL is set, otherwise a local SQLite file. Opened in
+# setup_hook and closed on shutdown; see store.py for both backends.
+STORE: PointsStore = (
+    PgStore(DATABASE_URL, per_guild=PER_GUILD, legacy_guild_id=GUILD_ID)
+    if DATABASE_URL else
+    SqliteStore(POINTS_DB_PATH, per_guild=PER_GUILD)
+)
 
 # ========== BOT ==========
 intents = discord.Intents.default()
@@ -201,20 +55,36 @@ bot = commands.Bot(
 )
 bot.remove_command("help")
 
-os.makedirs("temp", exist_ok=True)
+# Resolved in on_ready so the vouch flow doesn't look them up per message; until
+# then (or if the lookup missed) callers fall back to bot.get_channel
+TARGET_CHANNEL: Optional[discord.abc.Messageable] = None
+REVIEW_CHANNEL: Optional[discord.abc.Messageable] = None
+
+async def getch_member(guild: discord.Guild, user_id: int) -> discord.Member:
+    # Cache first; only hit the REST API when the member isn't cached
+    return guild.get_member(user_id) or await guild.fetch_member(user_id)
 
 # ========== IMAGE ==========
-def overlay_logo(user_image_path: str, logo_path: str, output_path: str) -> bool:
+# Decode the logo once; resized copies are memoized per target width. Widths
+# come from user uploads, so the cache is bounded.
+_LOGO_RGBA: Optional[Image.Image] = Image.open(LOGO_PATH).convert("RGBA") if os.path.exists(LOGO_PATH) else None
+
+@functools.lru_cache(maxsize=32)
+def _logo_for_width(logo_width: int) -> Image.Image:
+    logo_height = int(_LOGO_RGBA.height * (logo_width / _LOGO_RGBA.width))
+    return _LOGO_RGBA.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
+
+def overlay_logo(base_fp: io.BytesIO, output_buf: io.BytesIO) -> bool:
     try:
-        base = Image.open(user_image_path).convert("RGBA")
-        logo = Image.open(logo_path).convert("RGBA")
-        logo_width = max(1, base.width // 4)
-        logo_height = int(logo.height * (logo_width / logo.width))
-        logo = logo.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
+        # Stay in RGB: paste() blends the RGBA logo through its own alpha, so
+        # the full-size RGBA round-trip of the upload isn't needed for JPEG out
+        base = Image.open(base_fp)
+        if base.mode != "RGB":
+            base = base.convert("RGB")
+        logo = _logo_for_width(max(1, base.width // 4))
         pos = ((base.width - logo.width) // 2, (base.height - logo.height) // 2)
-        combined = base.copy()
-        combined.paste(logo, pos, logo)
-        combined.convert("RGB").save(output_path, "JPEG", quality=95)
+        base.paste(logo, pos, logo)
+        base.save(output_buf, "JPEG", quality=95)
         return True
     except Exception as e:
         print(f"[overlay_logo] Error: {e}")
@@ -222,20 +92,13 @@ def overlay_logo(user_image_path: str, logo_path: str, output_path: str) -> bool
 
 # ========== REVIEW UI ==========
 class VouchView(discord.ui.View):
-    def __init__(self, member_id: int, vouch_text: str, image_path: str):
+    def __init__(self, member_id: int, vouch_text: str, image_bytes: bytes):
         super().__init__(timeout=None)
         self.member_id = member_id
         self.vouch_text = vouch_text
-        self.image_path = image_path
+        self.image_bytes = image_bytes
         self._locked = False
 
-    def _cleanup_local_file(self):
-        try:
-            if os.path.exists(self.image_path):
-                os.remove(self.image_path)
-        except Exception:
-            pass
-
     @discord.ui.button(label="✅ Verify", style=discord.ButtonStyle.success)
     async def verify_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if self._locked:
@@ -245,8 +108,8 @@ class VouchView(discord.ui.View):
         await interaction.response.defer(ephemeral=True)
 
         try:
-            total = add_points(self.member_id, 1, guild_id=interaction.guild.id if PER_GUILD else None)
-            member = await interaction.guild.fetch_member(self.member_id)
+            total = await STORE.add(self.member_id, 1, guild_id=interaction.guild.id if PER_GUILD else None)
+            member = await getch_member(interaction.guild, self.member_id)
             member_display = member.display_name
 
             public_embed = discord.Embed(
@@ -257,12 +120,12 @@ class VouchView(discord.ui.View):
                 public_embed.description = f"**{self.vouch_text}**"
             public_embed.set_image(url="attachment://processed.jpg")
 
-            public_channel = bot.get_channel(TARGET_CHANNEL_ID)
-            if public_channel and os.path.exists(self.image_path):
+            public_channel = TARGET_CHANNEL or bot.get_channel(TARGET_CHANNEL_ID)
+            if public_channel:
                 await public_channel.send(
                     content=f"✅ Verified {SERVER_NAME} vouch for <@{self.member_id}>! They now have {total} points.",
                     embed=public_embed,
-                    file=discord.File(self.image_path, filename="processed.jpg")
+                    file=discord.File(io.BytesIO(self.image_bytes), filename="processed.jpg")
                 )
 
             await interaction.message.edit(
@@ -278,7 +141,9 @@ class VouchView(discord.ui.View):
             print(f"[verify_button] {e}")
             await interaction.followup.send(f"Unexpected error: {e}", ephemeral=True)
         finally:
-            self._cleanup_local_file()
+            # Stop the view so the ViewStore lets go of it, and drop the JPEG
+            self.stop()
+            self.image_bytes = b""
 
     @discord.ui.button(label="❌ Reject", style=discord.ButtonStyle.danger)
     async def reject_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -289,7 +154,7 @@ class VouchView(discord.ui.View):
         await interaction.response.defer(ephemeral=True)
 
         try:
-            target_channel = bot.get_channel(TARGET_CHANNEL_ID)
+            target_channel = TARGET_CHANNEL or bot.get_channel(TARGET_CHANNEL_ID)
             if target_channel:
                 await target_channel.send(f"❌ A {SERVER_NAME} vouch submission for <@{self.member_id}> was rejected.")
 
@@ -304,13 +169,23 @@ class VouchView(discord.ui.View):
             print(f"[reject_button] {e}")
             await interaction.followup.send(f"Unexpected error: {e}", ephemeral=True)
         finally:
-            self._cleanup_local_file()
+            # Stop the view so the ViewStore lets go of it, and drop the JPEG
+            self.stop()
+            self.image_bytes = b""
 
 # ========== EVENTS ==========
+@bot.event
+async def setup_hook():
+    await STORE.open()
+    if isinstance(STORE, SqliteStore):
+        print(f"[WARN] DATABASE_URL not set; points live in {POINTS_DB_PATH}, which won't survive a redeploy")
+
 @bot.event
 async def on_ready():
-    init_db()
-    print(f"✅ {bot.user} ready | PER_GUILD={PER_GUILD} | message_content={bot.intents.message_content}")
+    global TARGET_CHANNEL, REVIEW_CHANNEL
+    TARGET_CHANNEL = bot.get_channel(TARGET_CHANNEL_ID)
+    REVIEW_CHANNEL = bot.get_channel(REVIEW_CHANNEL_ID)
+    print(f"✅ {bot.user} ready | store={type(STORE).__name__} | PER_GUILD={PER_GUILD} | message_content={bot.intents.message_content}")
 
 @bot.event
 async def on_message(message: discord.Message):
@@ -326,20 +201,21 @@ async def on_message(message: discord.Message):
 
     if is_vouch_submission:
         attachment = message.attachments[0]
-        user_img = f"temp/user_{message.id}.png"
-        out_img = f"temp/processed_{message.id}.jpg"
-        review_channel = bot.get_channel(REVIEW_CHANNEL_ID)
+        review_channel = REVIEW_CHANNEL or bot.get_channel(REVIEW_CHANNEL_ID)
         if not review_channel:
             print(f"[CRITICAL] REVIEW_CHANNEL_ID {REVIEW_CHANNEL_ID} not found.")
             return
 
         try:
-            await attachment.save(user_img)
-            if not os.path.exists(LOGO_PATH):
+            if _LOGO_RGBA is None:
                 await message.channel.send("Logo missing. Please add logo.png.", delete_after=10)
                 return
 
-            if not overlay_logo(user_img, LOGO_PATH, out_img):
+            # Keep the upload in memory; PIL decodes straight from the buffer
+            buf = io.BytesIO()
+            await attachment.save(buf)
+            out_buf = io.BytesIO()
+            if not await asyncio.to_thread(overlay_logo, buf, out_buf):
                 await message.channel.send(f"{message.author.mention}, error processing your image.", delete_after=10)
                 return
 
@@ -352,17 +228,12 @@ async def on_message(message: discord.Message):
             embed.set_author(name=message.author.display_name, icon_url=avatar_url)
             embed.set_image(url="attachment://processed.jpg")
 
-            view = VouchView(member_id=message.author.id, vouch_text=vouch_text, image_path=out_img)
-            await review_channel.send(embed=embed, file=discord.File(out_img, filename="processed.jpg"), view=view)
+            image_bytes = out_buf.getvalue()
+            view = VouchView(member_id=message.author.id, vouch_text=vouch_text, image_bytes=image_bytes)
+            await review_channel.send(embed=embed, file=discord.File(io.BytesIO(image_bytes), filename="processed.jpg"), view=view)
             await message.delete()
         except Exception as e:
             print(f"[on_message] {e}")
-        finally:
-            try:
-                if os.path.exists(user_img):
-                    os.remove(user_img)
-            except Exception:
-                pass
         return
 
     await bot.process_commands(message)
@@ -371,33 +242,41 @@ async def on_message(message: discord.Message):
 @bot.command(name="addpoints")
 @commands.has_permissions(administrator=True)
 async def cmd_addpoints(ctx, member: discord.Member, points: int):
-    total = add_points(member.id, points, guild_id=ctx.guild.id if PER_GUILD else None)
+    total = await STORE.add(member.id, points, guild_id=ctx.guild.id if PER_GUILD else None)
     await ctx.send(f"Added {points} points to {member.mention}. They now have {total} points.")
 
+@bot.command(name="bulkaddpoints")
+@commands.has_permissions(administrator=True)
+async def cmd_bulk_addpoints(ctx, points: int, members: commands.Greedy[discord.Member]):
+    if not members:
+        return await ctx.send(f"Mention at least one member. Usage: `{ctx.prefix}{ctx.command.name} {ctx.command.signature}`")
+    guild_id = ctx.guild.id if PER_GUILD else None
+    await STORE.add_many([(guild_id, m.id, points) for m in members])
+    await ctx.send(f"Added {points} points to {len(members)} member{'s' if len(members) != 1 else ''}.")
+
 @bot.command(name="removepoints")
 @commands.has_permissions(administrator=True)
 async def cmd_removepoints(ctx, member: discord.Member, points: int):
-    total = remove_points(member.id, points, guild_id=ctx.guild.id if PER_GUILD else None)
+    total = await STORE.remove(member.id, points, guild_id=ctx.guild.id if PER_GUILD else None)
     await ctx.send(f"Removed {points} points from {member.mention}. They now have {total} points.")
 
 @bot.command(name="points")
 async def cmd_points(ctx, member: Optional[discord.Member] = None):
     member = member or ctx.author
-    total = get_points(member.id, guild_id=ctx.guild.id if PER_GUILD else None)
+    total = await STORE.get(member.id, guild_id=ctx.guild.id if PER_GUILD else None)
     await ctx.send(f"{member.mention} has {total} point{'s' if total != 1 else ''}.")
 
 @bot.command(name="resetpoints")
 @commands.has_permissions(administrator=True)
 async def cmd_resetpoints(ctx, member: discord.Member):
-    reset_points(member.id, guild_id=ctx.guild.id if PER_GUILD else None)
+    await STORE.reset(member.id, guild_id=ctx.guild.id if PER_GUILD else None)
     await ctx.send(f"{member.mention}'s points have been reset.")
 
 @bot.command(name="redeem")
 @commands.has_permissions(administrator=True)
 async def cmd_redeem(ctx, user: discord.Member):
-    total = get_points(user.id, guild_id=ctx.guild.id if PER_GUILD else None)
-    if total > 0:
-        reset_points(user.id, guild_id=ctx.guild.id if PER_GUILD else None)
+    redeemed = await STORE.redeem(user.id, guild_id=ctx.guild.id if PER_GUILD else None)
+    if redeemed > 0:
         await ctx.send(f"{user.mention}'s points have been reset for their reward.")
     else:
         await ctx.send(f"{user.mention} has no points to redeem.")
@@ -417,4 +296,12 @@ async def on_command_error(ctx, error):
     print(f"[on_command_error] {type(error).__name__}: {error}")
 
 # ========== RUN ==========
-bot.run(BOT_TOKEN)
+async def main():
+    discord.utils.setup_logging()  # what bot.run() would have done for us
+    async with bot:
+        try:
+            await bot.start(BOT_TOKEN)
+        finally:
+            await STORE.close()
+
+asyncio.run(main())
@@ -0,0 +1,435 @@
+# store.py — points storage backends for the Fuel Cart Vouch Bot
+#
+# bot.py talks to a PointsStore and never to a driver directly. PgStore runs on
+# an asyncpg pool (with the legacy auto-migration); SqliteStore runs on a single
+# aiosqlite connection for local/self-hosted runs without DATABASE_URL.
+#
+# The standalone SQLite bot under Downloads/ is deployed on its own and keeps
+# its own user_id-keyed table and cache; it does not use this module.
+
+from typing import Optional, Protocol
+
+import aiosqlite
+import asyncpg
+
+Row = tuple[Optional[int], int, int]  # (guild_id, user_id, delta)
+
+
+class PointsStore(Protocol):
+    async def open(self) -> None: ...
+    async def close(self) -> None: ...
+    async def get(self, user_id: int, guild_id: Optional[int] = None) -> int: ...
+    async def add(self, user_id: int, amount: int, guild_id: Optional[int] = None) -> int: ...
+    async def add_many(self, rows: list[Row]) -> None: ...
+    async def remove(self, user_id: int, amount: int, guild_id: Optional[int] = None) -> int: ...
+    async def reset(self, user_id: int, guild_id: Optional[int] = None) -> None: ...
+    async def redeem(self, user_id: int, guild_id: Optional[int] = None) -> int: ...
+
+
+class _CachedStore:
+    """
+    Write-through cache of point totals keyed by (guild_id, user_id); guild_id
+    is None when per_guild=False. Writers store the value they got back from
+    RETURNING, so reads can be served from memory.
+    """
+
+    def __init__(self, per_guild: bool):
+        self.per_guild = per_guild
+        self._cache: dict[tuple[Optional[int], int], int] = {}
+
+    def _key(self, user_id: int, guild_id: Optional[int]) -> tuple[Optional[int], int]:
+        if not self.per_guild:
+            return (None, user_id)
+        if guild_id is None: raise ValueError("guild_id required (PER_GUILD=True)")
+        return (guild_id, user_id)
+
+    def _merge(self, rows: list[Row]) -> dict[tuple[Optional[int], int], int]:
+        # One upsert can't touch the same row twice, so fold repeated users first
+        deltas: dict[tuple[Optional[int], int], int] = {}
+        for gid, uid, delta in rows:
+            key = self._key(uid, gid)
+            deltas[key] = deltas.get(key, 0) + delta
+        return deltas
+
+
+# ========== POSTGRES ==========
+class PgStore(_CachedStore):
+    def __init__(self, dsn: str, per_guild: bool, legacy_guild_id: int):
+        super().__init__(per_guild)
+        self.dsn = dsn
+        self.legacy_guild_id = legacy_guild_id  # backfill for rows from the old global schema
+        self.pool: Optional[asyncpg.Pool] = None
+
+    async def open(self) -> None:
+        # asyncpg prepares each query text once per connection and caches it; keep
+        # those prepared statements for the connection's lifetime instead of
+        # re-parsing the hot points queries every 5 minutes (the default).
+        self.pool = await asyncpg.create_pool(
+            self.dsn, ssl="require", min_size=2, max_size=10,
+            max_cached_statement_lifetime=0,
+        )
+        await self._init_db()
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def _schema_ok(self, conn: asyncpg.Connection) -> bool:
+        """True when 'points' already has the per-guild columns and (guild_id, user_id) PK."""
+        return await conn.fetchval("""
+        SELECT EXISTS (
+                 SELECT 1
+                 FROM   pg_constraint c
+                 WHERE  c.conrelid = to_regclass('points') AND c.contype = 'p'
+                   AND  c.conkey = ARRAY(
+                          SELECT attnum FROM pg_attribute
+                          WHERE  attrelid = to_regclass('points') AND attname IN ('guild_id', 'user_id')
+                          ORDER  BY attname
+                        )::smallint[]
+               )
+           AND (SELECT count(*) FROM information_schema.columns
+                WHERE table_name='points' AND column_name IN ('guild_id', 'updated_at')) = 2;
+        """)
+
+    async def _init_db(self) -> None:
+        """
+        Ensure the 'points' table exists. If an old global schema exists, migrate it
+        to (guild_id, user_id) PK when per_guild=True. Safe to run repeatedly.
+        """
+        async with self.pool.acquire() as conn:
+            # Create table if missing (start with per-guild or global shape)
+            if self.per_guild:
+                # Already migrated? Then skip the DDL below and its table locks.
+                if not await self._schema_ok(conn):
+                    await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS points (
+                        guild_id   BIGINT NOT NULL,
+                        user_id    BIGINT NOT NULL,
+                        points     INTEGER NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        PRIMARY KEY (guild_id, user_id)
+                    );
+                    """)
+                    # If an old global table exists, it may lack columns/PK
+                    # 1) ensure columns exist
+                    await conn.execute("ALTER TABLE points ADD COLUMN IF NOT EXISTS guild_id BIGINT;")
+                    await conn.execute("ALTER TABLE points ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();")
+                    # 2) if guild_id is NULL (from old rows), backfill with this bot's guild
+                    await conn.execute("UPDATE points SET guild_id=$1 WHERE guild_id IS NULL;", self.legacy_guild_id)
+                    # 3) ensure PK is (guild_id, user_id)
+                    # drop any existing PK and re-add
+                    await conn.execute("""
+                    DO $$
+                    DECLARE pkname text;
+                    BEGIN
+                      SELECT conname INTO pkname
+                      FROM   pg_constraint c
+                      JOIN   pg_class t ON t.oid = c.conrelid
+                      WHERE  t.relname = 'points' AND c.contype = 'p'
+                      LIMIT 1;
+                      IF pkname IS NOT NULL THEN
+                        EXECUTE format('ALTER TABLE points DROP CONSTRAINT %I', pkname);
+                      END IF;
+                    END$$;
+                    """)
+                    await conn.execute("ALTER TABLE points ADD PRIMARY KEY (guild_id, user_id);")
+                # Cross-guild lookups by user alone can't use the composite PK
+                await conn.execute("CREATE INDEX IF NOT EXISTS points_user_id_idx ON points (user_id);")
+            else:
+                # Global points
+                await conn.execute("""
+                CREATE TABLE IF NOT EXISTS points (
+                    user_id    BIGINT PRIMARY KEY,
+                    points     INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """)
+                # If table was per-guild, collapse to global by summing points
+                # (only if there's a guild_id column)
+                has_guild_id = await conn.fetchval("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name='points' AND column_name='guild_id';
+                """)
+                if has_guild_id:
+                    # Build a temp table with summed totals
+                    await conn.execute("""
+                    CREATE TEMP TABLE _tmp_points AS
+                      SELECT user_id, SUM(points)::int AS points
+                      FROM points
+                      GROUP BY user_id;
+                    """)
+                    # Replace real table with global shape
+                    await conn.execute("DROP TABLE IF EXISTS points;")
+                    await conn.execute("""
+                    CREATE TABLE points (
+                        user_id    BIGINT PRIMARY KEY,
+                        points     INTEGER NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    );
+                    """)
+                    await conn.execute("""
+                    INSERT INTO points (user_id, points) SELECT user_id, points FROM _tmp_points;
+                    """)
+                    await conn.execute("DROP TABLE _tmp_points;")
+
+    async def get(self, user_id: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        async with self.pool.acquire() as conn:
+            if self.per_guild:
+                total = await conn.fetchval("SELECT points FROM points WHERE guild_id=$1 AND user_id=$2;", guild_id, user_id)
+            else:
+                total = await conn.fetchval("SELECT points FROM points WHERE user_id=$1;", user_id)
+        total = int(total) if total is not None else 0
+        # A writer that finished while we awaited has the newer value; let it win
+        total = self._cache.setdefault(key, total)
+        return total
+
+    async def add(self, user_id: int, amount: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        async with self.pool.acquire() as conn:
+            if self.per_guild:
+                total = await conn.fetchval("""
+                    INSERT INTO points (guild_id, user_id, points)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (guild_id, user_id)
+                    DO UPDATE SET points = points.points + EXCLUDED.points,
+                                  updated_at = NOW()
+                    RETURNING points;
+                """, guild_id, user_id, amount)
+            else:
+                total = await conn.fetchval("""
+                    INSERT INTO points (user_id, points)
+                    VALUES ($1, $2)
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET points = points.points + EXCLUDED.points,
+                                  updated_at = NOW()
+                    RETURNING points;
+                """, user_id, amount)
+        self._cache[key] = total = int(total)
+        return total
+
+    async def add_many(self, rows: list[Row]) -> None:
+        """Apply many (guild_id, user_id, delta) credits in one upsert and cache the new totals."""
+        deltas = self._merge(rows)
+        if not deltas:
+            return
+        user_ids = [uid for _, uid in deltas]
+        async with self.pool.acquire() as conn:
+            if self.per_guild:
+                records = await conn.fetch("""
+                    INSERT INTO points (guild_id, user_id, points)
+                    SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::int[])
+                    ON CONFLICT (guild_id, user_id)
+                    DO UPDATE SET points = points.points + EXCLUDED.points,
+                                  updated_at = NOW()
+                    RETURNING guild_id, user_id, points;
+                """, [gid for gid, _ in deltas], user_ids, list(deltas.values()))
+            else:
+                records = await conn.fetch("""
+                    INSERT INTO points (user_id, points)
+                    SELECT * FROM unnest($1::bigint[], $2::int[])
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET points = points.points + EXCLUDED.points,
+                                  updated_at = NOW()
+                    RETURNING NULL::bigint AS guild_id, user_id, points;
+                """, user_ids, list(deltas.values()))
+        # Store the RETURNING totals like the single-row writers do; evicting
+        # instead would let a get() that read before this upsert refill a stale value
+        for r in records:
+            self._cache[(r["guild_id"], r["user_id"])] = int(r["points"])
+
+    async def remove(self, user_id: int, amount: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        # Clamp at 0 server-side so the read and the write are one round-trip.
+        async with self.pool.acquire() as conn:
+            if self.per_guild:
+                total = await conn.fetchval("""
+                    INSERT INTO points (guild_id, user_id, points)
+                    VALUES ($1, $2, 0)
+                    ON CONFLICT (guild_id, user_id)
+                    DO UPDATE SET points = GREATEST(points.points - $3, 0),
+                                  updated_at = NOW()
+                    RETURNING points;
+                """, guild_id, user_id, amount)
+            else:
+                total = await conn.fetchval("""
+                    INSERT INTO points (user_id, points)
+                    VALUES ($1, 0)
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET points = GREATEST(points.points - $2, 0),
+                                  updated_at = NOW()
+                    RETURNING points;
+                """, user_id, amount)
+        self._cache[key] = total = int(total)
+        return total
+
+    async def reset(self, user_id: int, guild_id: Optional[int] = None) -> None:
+        key = self._key(user_id, guild_id)
+        async with self.pool.acquire() as conn:
+            if self.per_guild:
+                await conn.execute("""
+                    INSERT INTO points (guild_id, user_id, points)
+                    VALUES ($1, $2, 0)
+                    ON CONFLICT (guild_id, user_id)
+                    DO UPDATE SET points = 0,
+                                  updated_at = NOW();
+                """, guild_id, user_id)
+            else:
+                await conn.execute("""
+                    INSERT INTO points (user_id, points)
+                    VALUES ($1, 0)
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET points = 0,
+                                  updated_at = NOW();
+                """, user_id)
+        self._cache[key] = 0
+
+    async def redeem(self, user_id: int, guild_id: Optional[int] = None) -> int:
+        """Zero a positive balance in one statement; returns the redeemed amount (0 if none)."""
+        key = self._key(user_id, guild_id)
+        async with self.pool.acquire() as conn:
+            if self.per_guild:
+                redeemed = await conn.fetchval("""
+                    WITH prev AS (
+                        SELECT points FROM points
+                        WHERE guild_id=$1 AND user_id=$2 AND points > 0
+                        FOR UPDATE
+                    )
+                    UPDATE points SET points = 0,
+                                      updated_at = NOW()
+                    WHERE guild_id=$1 AND user_id=$2 AND EXISTS (SELECT 1 FROM prev)
+                    RETURNING (SELECT points FROM prev);
+                """, guild_id, user_id)
+            else:
+                redeemed = await conn.fetchval("""
+                    WITH prev AS (
+                        SELECT points FROM points
+                        WHERE user_id=$1 AND points > 0
+                        FOR UPDATE
+                    )
+                    UPDATE points SET points = 0,
+                                      updated_at = NOW()
+                    WHERE user_id=$1 AND EXISTS (SELECT 1 FROM prev)
+                    RETURNING (SELECT points FROM prev);
+                """, user_id)
+        self._cache[key] = 0
+        return int(redeemed) if redeemed is not None else 0
+
+
+# ========== SQLITE ==========
+class SqliteStore(_CachedStore):
+    """
+    One autocommit aiosqlite connection (statements run on its worker thread).
+    Both modes share the (guild_id, user_id) table; global mode stores guild_id=0.
+    """
+
+    def __init__(self, path: str, per_guild: bool):
+        super().__init__(per_guild)
+        self.path = path
+        self.db: Optional[aiosqlite.Connection] = None
+
+    async def open(self) -> None:
+        self.db = await aiosqlite.connect(self.path, isolation_level=None)
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        await self.db.execute("PRAGMA synchronous=NORMAL")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS points(
+                guild_id   INTEGER NOT NULL,
+                user_id    INTEGER NOT NULL,
+                points     INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (guild_id, user_id)
+            )
+        """)
+
+    async def close(self) -> None:
+        # aiosqlite's worker thread keeps the process alive until closed
+        if self.db is not None:
+            await self.db.close()
+
+    @staticmethod
+    def _gid(key: tuple[Optional[int], int]) -> int:
+        return key[0] or 0
+
+    async def get(self, user_id: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        async with self.db.execute(
+            "SELECT points FROM points WHERE guild_id = ? AND user_id = ?", (self._gid(key), user_id)
+        ) as cur:
+            row = await cur.fetchone()
+        total = row[0] if row else 0
+        # A writer that finished while we awaited has the newer value; let it win
+        total = self._cache.setdefault(key, total)
+        return total
+
+    async def add(self, user_id: int, amount: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        async with self.db.execute("""
+            INSERT INTO points(guild_id, user_id, points) VALUES(?, ?, ?)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET points = points + excluded.points,
+                          updated_at = CURRENT_TIMESTAMP
+            RETURNING points
+        """, (self._gid(key), user_id, amount)) as cur:
+            (total,) = await cur.fetchone()
+        self._cache[key] = total
+        return total
+
+    async def add_many(self, rows: list[Row]) -> None:
+        deltas = self._merge(rows)
+        if not deltas:
+            return
+        # executemany can't hand back RETURNING rows; a multi-row VALUES can
+        values = ", ".join(["(?, ?, ?)"] * len(deltas))
+        params = [v for key, delta in deltas.items() for v in (self._gid(key), key[1], delta)]
+        async with self.db.execute(f"""
+            INSERT INTO points(guild_id, user_id, points) VALUES {values}
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET points = points + excluded.points,
+                          updated_at = CURRENT_TIMESTAMP
+            RETURNING guild_id, user_id, points
+        """, params) as cur:
+            returned = await cur.fetchall()
+        for gid, uid, total in returned:
+            self._cache[(gid if self.per_guild else None, uid)] = total
+
+    async def remove(self, user_id: int, amount: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        async with self.db.execute("""
+            INSERT INTO points(guild_id, user_id, points) VALUES(?, ?, 0)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET points = MAX(points - ?, 0),
+                          updated_at = CURRENT_TIMESTAMP
+            RETURNING points
+        """, (self._gid(key), user_id, amount)) as cur:
+            (total,) = await cur.fetchone()
+        self._cache[key] = total
+        return total
+
+    async def reset(self, user_id: int, guild_id: Optional[int] = None) -> None:
+        key = self._key(user_id, guild_id)
+        await self.db.execute("""
+            INSERT INTO points(guild_id, user_id, points) VALUES(?, ?, 0)
+            ON CONFLICT(guild_id, user_id)
+            DO UPDATE SET points = 0,
+                          updated_at = CURRENT_TIMESTAMP
+        """, (self._gid(key), user_id))
+        self._cache[key] = 0
+
+    async def redeem(self, user_id: int, guild_id: Optional[int] = None) -> int:
+        key = self._key(user_id, guild_id)
+        # SQLite's RETURNING only sees new values on UPDATE; DELETE returns the
+        # old balance atomically, and a missing row already reads as 0.
+        async with self.db.execute(
+            "DELETE FROM points WHERE guild_id = ? AND user_id = ? AND points > 0 RETURNING points",
+            (self._gid(key), user_id),
+        ) as cur:
+            row = await cur.fetchone()
+        self._cache[key] = 0
+        return row[0] if row else 0